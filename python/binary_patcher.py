@@ -1,85 +1,153 @@
 #!/usr/bin/env python
 """Handles inspecting and patching binary files
 """
+import functools
+import os
 import struct
 import binascii
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@functools.lru_cache(maxsize=None)
+def _get_struct(fmt):
+    """Gets a compiled struct.Struct for a format string, caching it so
+    repeated reads/writes skip the format parse"""
+    return struct.Struct(fmt)
+
+
+# Warm the cache with the fixed-width integer formats that dominate
+# patching workloads, so their first use skips the compile too
+for _fmt in ('<b', '<B', '<h', '<H', '<i', '<I', '<q', '<Q',
+             '>b', '>B', '>h', '>H', '>i', '>I', '>q', '>Q'):
+    _get_struct(_fmt)
+del _fmt
+
 
 class BinaryPatcher(object):
+    __slots__ = ('data', 'cursor')
+
     def __init__(self, input_fname):
         super(BinaryPatcher, self).__init__()
         with open(input_fname, 'rb') as fobj:
-            self.data = fobj.read()
+            self.data = bytearray(os.fstat(fobj.fileno()).st_size)
+            fobj.readinto(self.data)
         self.cursor = 0
 
     def seek(self, offs):
         self.cursor = offs
 
-    def read(self, fmt, **kwargs):
-        offs = self.cursor
-        if 'offs' in kwargs:
-            offs = kwargs['offs']
+    def read(self, fmt, offs=None):
+        if offs is None:
+            offs = self.cursor
+
+        s = _get_struct(fmt)
+        v = s.unpack_from(self.data, offs)
+        self.cursor = offs + s.size
+        return v
 
-        v = struct.unpack_from(fmt, self.data, offs)
-        self.cursor = offs + struct.calcsize(fmt)
+    def read_one(self, fmt, offs=None):
+        """Reads a single-field format and returns the value itself
+        rather than a one-element tuple"""
+        return self.read(fmt, offs)[0]
+
+    def write(self, fmt, *values, offs=None):
+        if offs is None:
+            offs = self.cursor
+
+        s = _get_struct(fmt)
+        s.pack_into(self.data, offs, *values)
+        self.cursor = offs + s.size
+
+    def read_array(self, dtype, count, offs=None):
+        """Reads an array of count dtype elements as a zero-copy numpy
+        view. The view pins the backing buffer: insert and cut raise
+        BufferError while it is alive"""
+        if offs is None:
+            offs = self.cursor
+        if numpy is None:
+            raise ImportError('numpy is required for array access')
+
+        dtype = numpy.dtype(dtype)
+        v = numpy.frombuffer(self.data, dtype=dtype, count=count,
+                             offset=offs)
+        self.cursor = offs + dtype.itemsize * count
         return v
 
-    def write(self, fmt, *values, **kwargs):
-        offs = self.cursor
-        if 'offs' in kwargs:
-            offs = kwargs['offs']
-        size = struct.calcsize(fmt)
+    def write_array(self, array, offs=None):
+        if offs is None:
+            offs = self.cursor
+        if numpy is None:
+            raise ImportError('numpy is required for array access')
 
-        s = struct.pack(fmt, *values)
-        self.data = self.data[:offs] + s + self.data[offs + size:]
-        self.cursor = offs + size
+        s = numpy.asarray(array).tobytes()
+        self.data[offs:offs + len(s)] = s
+        self.cursor = offs + len(s)
 
     def insert(self, offs, size, data=None):
         if data is None:
-            data = '\x00' * size
+            data = bytes(size)
 
-        self.data = self.data[:offs] + data + self.data[offs:]
+        self.data[offs:offs] = data
 
     def cut(self, offs, size):
-        orig = self.data[offs:offs + size]
-        self.data = self.data[:offs] + self.data[offs + size:]
+        orig = bytes(self.data[offs:offs + size])
+        del self.data[offs:offs + size]
         return orig
 
+    def apply_edits(self, edits):
+        """Applies a batch of (offs, size, data) edits in one pass:
+        each removes size bytes at offs and inserts data there. Offsets
+        refer to the data before any edit; overlapping or out-of-range
+        edits raise IndexError before anything is modified."""
+        new_data = bytearray()
+        pos = 0
+        for offs, size, data in sorted(edits):
+            if not (pos <= offs <= offs + size <= len(self.data)):
+                raise IndexError()
+            new_data += self.data[pos:offs]
+            new_data += data
+            pos = offs + size
+        new_data += self.data[pos:]
+        self.data = new_data
+
     def write_file(self, output_fname):
         with open(output_fname, 'wb') as fobj:
             fobj.write(self.data)
 
 
 def main():
-    import os
     with open('inputfile', 'wb') as fobj:
-        fobj.write('\xAA\x11\x22\x33\x44\x55\x66\x77')
+        fobj.write(b'\xAA\x11\x22\x33\x44\x55\x66\x77')
 
     b = BinaryPatcher('inputfile')
 
-    v = b.read('<I', offs=0x0)[0]
+    v = b.read_one('<I', offs=0x0)
     print('Read 0x{:08X}'.format(v))
     assert v == 0x332211AA
 
     b.write('<I', 0xFFFFFFFF, offs=0x4)
-    v = b.read('<I', offs=0x2)[0]
+    v = b.read_one('<I', offs=0x2)
     print('Read 0x{:08X}'.format(v))
     assert v == 0xFFFF3322
 
     b.insert(0x0, 0x4)
-    v = b.read('<I', offs=0x0)[0]
+    v = b.read_one('<I', offs=0x0)
     print('Read 0x{:08X}'.format(v))
     assert v == 0x00000000
 
     v = b.cut(0x6, 4)
     print('Cut {}'.format(binascii.hexlify(v)))
-    assert v == '\x22\x33\xFF\xFF'
+    assert v == b'\x22\x33\xFF\xFF'
 
     b.write_file('outputfile')
 
     with open('outputfile', 'rb') as fobj:
         v = fobj.read()
-        assert v == '\x00\x00\x00\x00\xAA\x11\xFF\xFF'
+        assert v == b'\x00\x00\x00\x00\xAA\x11\xFF\xFF'
 
     os.remove('inputfile')
     os.remove('outputfile')
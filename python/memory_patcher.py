@@ -1,9 +1,35 @@
 #!/usr/bin/env python
 """Handles loading multiple binary files, inspecting them and patching them.
 """
+import bisect
+import functools
 import struct
 
-from typing import IO, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import IO, List, Optional, Tuple, Union
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@functools.lru_cache(maxsize=None)
+def compile_struct(fmt):
+    # type: (str) -> struct.Struct
+    """Compiles a struct.Struct for a format string, caching the
+    result per distinct format"""
+    return struct.Struct(fmt)
+
+
+def _as_struct(s):
+    # type: (Union[struct.Struct, str]) -> struct.Struct
+    """Accepts either a compiled struct.Struct or a format string,
+    compiling and caching the latter"""
+    if isinstance(s, str):
+        return compile_struct(s)
+    return s
 
 
 class InvalidAddressException(Exception):
@@ -17,26 +43,50 @@ class WriteException(Exception):
 
 
 class MemoryPatcher(object):
+    __slots__ = ('_segments', '_bases', '_by_name')
+
     def __init__(self):
         super(MemoryPatcher, self).__init__()
-        self.segments = []
+        self._segments = []
+        self._bases = []
+        self._by_name = {}
+
+    @property
+    def segments(self):
+        # type: () -> List[Segment]
+        """The segments in this patcher, sorted by base address.
+        Returns a copy; add segments with add_segment or by assigning
+        a new list, not by mutating the returned one"""
+        return list(self._segments)
+
+    @segments.setter
+    def segments(self, segments):
+        # type: (List[Segment]) -> None
+        segments = sorted(segments, key=lambda s: s.base)
+        for prev, cur in zip(segments, segments[1:]):
+            if prev.end > cur.base:
+                raise ValueError()
+        self._segments = segments
+        self._bases = [s.base for s in self._segments]
+        self._by_name = {s.name: s for s in self._segments
+                         if s.name is not None}
 
     def get_segment(self, addr):
         # type: (int) -> Optional[Segment]
-        """Gets the segment that contains addr or None if one is not 
-        found."""
-        for segment in self.segments:
-            if addr in segment:
+        """Gets the segment that contains addr or None if one is not
+        found. The end address of a segment is treated as contained so
+        that it can be used as an insertion point."""
+        i = bisect.bisect_right(self._bases, addr) - 1
+        if i >= 0:
+            segment = self._segments[i]
+            if addr <= segment.end:
                 return segment
         return None
 
     def get_segment_by_name(self, name):
         # type: (str) -> Optional[Segment]
         """Gets a segment by name or None is one is not found."""
-        for segment in self.segments:
-            if segment.name == name:
-                return segment
-        return None
+        return self._by_name.get(name)
 
     def addr_to_segment_offset(self, addr):
         # type: (int) -> Tuple[Segment, int]
@@ -49,16 +99,26 @@ class MemoryPatcher(object):
 
     def add_segment(self, base_addr, size, writeable=True, name=None):
         # type: (int, int, bool, str) -> Segment
-        """Adds a segment"""
+        """Adds a segment. Raises ValueError if it would overlap an
+        existing segment"""
         segment = Segment(base_addr, size, writeable, name)
-        self.segments.append(segment)
+        i = bisect.bisect_right(self._bases, segment.base)
+        if i > 0 and self._segments[i - 1].end > segment.base:
+            raise ValueError()
+        if i < len(self._segments) and segment.end > self._segments[i].base:
+            raise ValueError()
+        self._segments.insert(i, segment)
+        self._bases.insert(i, segment.base)
+        if segment.name is not None:
+            self._by_name[segment.name] = segment
         return segment
 
-    def read(self, addr, length):
-        # type: (int, int) -> bytes
-        """Reads bytes from a segment's data at an address"""
+    def read(self, addr, length, copy=True):
+        # type: (int, int, bool) -> bytes
+        """Reads bytes from a segment's data at an address. With
+        copy=False returns a zero-copy memoryview (see Segment.read)"""
         seg = self[addr]
-        return seg.read(seg.addr_to_segment_offset(addr), length)
+        return seg.read(seg.addr_to_segment_offset(addr), length, copy)
 
     def write(self, addr, data):
         # type: (int, bytes) -> bytes
@@ -67,9 +127,40 @@ class MemoryPatcher(object):
         seg = self[addr]
         return seg.write(seg.addr_to_segment_offset(addr), data)
 
+    def write_many(self, patches, max_workers=None):
+        """Applies a batch of (addr, data) writes, grouping them by
+        segment and writing each segment's group in a separate thread.
+        Every write is resolved, bounds-checked and checked for
+        writeability before anything is written. Returns the bytes
+        each write replaced, in the order given"""
+        patches = list(patches)
+        by_segment = {}
+        for i, (addr, data) in enumerate(patches):
+            segment, offset = self.addr_to_segment_offset(addr)
+            segment._check_offset_len(offset, len(data))
+            segment._check_writeable()
+            by_segment.setdefault(segment, []).append((i, offset, data))
+
+        results = [None] * len(patches)
+
+        def apply_group(segment, group):
+            for i, offset, data in group:
+                results[i] = segment.write(offset, data)
+
+        if len(by_segment) <= 1:
+            for segment, group in by_segment.items():
+                apply_group(segment, group)
+        else:
+            with ThreadPoolExecutor(max_workers) as pool:
+                futures = [pool.submit(apply_group, segment, group)
+                           for segment, group in by_segment.items()]
+                for future in futures:
+                    future.result()
+        return results
+
     def insert(self, addr, data):
         # type: (int, bytes) -> int
-        """Inserts bytes into a segment's data at an address. Returns 
+        """Inserts bytes into a segment's data at an address. Returns
         offset + len(data)"""
         seg = self[addr]
         return seg.insert(seg.addr_to_segment_offset(addr), data)
@@ -102,6 +193,15 @@ class MemoryPatcher(object):
         seg = self[addr]
         return seg.insert_struct(seg.addr_to_segment_offset(addr), s, *values)
 
+    def map_arena(self, buffer):
+        # type: (bytearray) -> None
+        """Backs every segment with a window of one shared writable
+        buffer, using each segment's base address as its offset into
+        the buffer. Writes through any segment are visible to every
+        other user of the arena."""
+        for segment in self._segments:
+            segment.map_buffer(buffer, segment.base)
+
     def __getitem__(self, address):
         # type: (int) -> Segment
         """Gets the segment the contains an address"""
@@ -113,6 +213,8 @@ class MemoryPatcher(object):
 
 
 class Segment(object):
+    __slots__ = ('base', 'size', 'end', 'writeable', 'name', '_data')
+
     def __init__(self, base, size, writeable=True, name=None):
         # type: (int, int, bool, str) -> None
         super(Segment, self).__init__()
@@ -123,7 +225,18 @@ class Segment(object):
         self.end = base + size
         self.writeable = writeable
         self.name = name
-        self.data = b''
+        self._data = bytearray()
+
+    @property
+    def data(self):
+        """This segment's backing buffer: a private bytearray, or a
+        memoryview window when mapped onto a shared buffer"""
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        # type: (bytes) -> None
+        self._data = bytearray(data)
 
     def addr_to_segment_offset(self, addr):
         # type: (int) -> int
@@ -132,88 +245,193 @@ class Segment(object):
             raise InvalidAddressException()
         return addr - self.base
 
+    def map_buffer(self, buffer, offset=0):
+        # type: (bytearray, int) -> None
+        """Backs this segment with a window of a shared writable buffer
+        instead of a private copy. The mapping is zero-copy, so writes
+        through this segment are visible to every other user of the
+        buffer. Mapped segments cannot be resized by insert or cut."""
+        view = memoryview(buffer)[offset:offset + self.size]
+        if len(view) < self.size:
+            raise IndexError()
+        self._data = view
+
     def load_stream(self, stream):
         # type: (IO[bytes]) -> None
-        """Load a stream's data into this segment"""
-        data = stream.read()
-        if len(data) > self.size:
+        """Load a stream's data into this segment. A mapped segment is
+        filled in place through its window, so the data lands in the
+        shared buffer and the mapping stays intact"""
+        # Read into a preallocated buffer (one byte of headroom to
+        # detect oversized streams) instead of copying stream.read()
+        buf = bytearray(self.size + 1)
+        n = stream.readinto(buf)
+        if n > self.size:
             raise IndexError()
-        self.data = data
+        if isinstance(self._data, memoryview):
+            self._data[:n] = buf[:n]
+        else:
+            del buf[n:]
+            self._data = buf
 
     def save_stream(self, stream):
         # type: (IO[bytes]) -> None
         """Save a this segment's data into a stream"""
         stream.write(self.data)
 
-    def read(self, offset, length):
-        # type: (int, int) -> bytes
-        """Reads bytes from this segment's data at an offset"""
+    def read(self, offset, length, copy=True):
+        # type: (int, int, bool) -> bytes
+        """Reads bytes from this segment's data at an offset. With
+        copy=False returns a zero-copy memoryview instead of bytes;
+        note that while such a view is alive the backing buffer cannot
+        be resized, so insert and cut raise BufferError until the view
+        is released"""
         self._check_offset_len(offset, length)
-        return self.data[offset:offset + length]
+        view = memoryview(self.data)[offset:offset + length]
+        if copy:
+            return bytes(view)
+        return view
 
     def write(self, offset, data):
         # type: (int, bytes) -> bytes
-        """Replaces this segment's data at an offset. Returns the bytes that 
+        """Replaces this segment's data at an offset. Returns the bytes that
         were replaced"""
         self._check_offset_len(offset, len(data))
-        orig_data = self.data[offset:offset + len(data)]
-        self._update_data(
-            self.data[:offset] + data + self.data[offset + len(data):])
+        self._check_writeable()
+        orig_data = bytes(self.data[offset:offset + len(data)])
+        self.data[offset:offset + len(data)] = data
         return orig_data
 
     def insert(self, offset, data):
         # type: (int, bytes) -> int
-        """Inserts bytes into this segment's data at an offset. Returns 
+        """Inserts bytes into this segment's data at an offset. Returns
         offset + len(data)"""
         if not (0 <= offset <= len(self.data)):
             raise IndexError()
-        self._update_data(self.data[:offset] + data + self.data[offset:])
+        self._check_resizeable()
+        self.data[offset:offset] = data
         return offset + len(data)
 
     def cut(self, offset, length):
         # type: (int, int) -> bytes
-        """Removes bytes from this segment's data at an offset. Returns the 
+        """Removes bytes from this segment's data at an offset. Returns the
         removed bytes"""
         self._check_offset_len(offset, length)
-        orig_data = self.data[offset:offset + length]
-        self._update_data(self.data[:offset] + self.data[offset + length:])
+        self._check_resizeable()
+        orig_data = bytes(self.data[offset:offset + length])
+        del self.data[offset:offset + length]
         return orig_data
 
+    def read_array(self, offset, dtype, count):
+        """Reads an array of count dtype elements from this segment's
+        data at an offset. Returns a zero-copy numpy view that pins
+        the backing buffer: insert and cut raise BufferError while the
+        view is alive"""
+        if numpy is None:
+            raise ImportError('numpy is required for array access')
+        dtype = numpy.dtype(dtype)
+        self._check_offset_len(offset, dtype.itemsize * count)
+        return numpy.frombuffer(
+            self.data, dtype=dtype, count=count, offset=offset)
+
+    def write_array(self, offset, array):
+        """Replaces this segment's data at an offset with the contents
+        of a numpy array. Returns the bytes that were replaced"""
+        if numpy is None:
+            raise ImportError('numpy is required for array access')
+        return self.write(offset, numpy.asarray(array).tobytes())
+
+    def apply_edits(self, edits):
+        """Applies a batch of (offset, cut_length, insert_data) edits
+        in a single pass over the data. Each edit removes cut_length
+        bytes at offset and inserts insert_data in their place.
+        Offsets refer to the data before any edit and must not
+        overlap; edits may be given in any order. A batch of N edits
+        rebuilds the buffer once instead of shifting the tail N times
+        as repeated insert/cut calls would."""
+        self._check_resizeable()
+        new_data = bytearray()
+        pos = 0
+        for offset, cut_length, insert_data in sorted(edits):
+            if not (pos <= offset <= offset + cut_length
+                    <= len(self._data)):
+                raise IndexError()
+            new_data += self._data[pos:offset]
+            new_data += insert_data
+            pos = offset + cut_length
+        new_data += self._data[pos:]
+        self._data = new_data
+
     def read_struct(self, offset, s):
         # type: (int, struct.Struct) -> Tuple
-        """Unpacks a struct from this segment's data at an offset. Returns 
-        a tuple of values"""
-        return s.unpack(self.read(offset, s.size))
+        """Unpacks a struct from this segment's data at an offset. The
+        struct may be given compiled or as a format string. Returns a
+        tuple of values"""
+        s = _as_struct(s)
+        self._check_offset_len(offset, s.size)
+        return s.unpack_from(self.data, offset)
 
     def write_struct(self, offset, s, *values):
         # type: (int, struct.Struct, *object) -> bytes
-        """Packs a struct into this segment's data at an offset. Returns 
+        """Packs a struct into this segment's data at an offset. The
+        struct may be given compiled or as a format string. Returns
         the bytes that were replaced"""
-        return self.write(offset, s.pack(offset, *values))
+        s = _as_struct(s)
+        self._check_offset_len(offset, s.size)
+        self._check_writeable()
+        orig_data = bytes(self.data[offset:offset + s.size])
+        s.pack_into(self.data, offset, *values)
+        return orig_data
+
+    def read_struct_array(self, offset, s, count):
+        # type: (int, struct.Struct, int) -> List[Tuple]
+        """Unpacks count consecutive structs from this segment's data at
+        an offset. Returns a list of value tuples"""
+        s = _as_struct(s)
+        self._check_offset_len(offset, s.size * count)
+        view = memoryview(self.data)[offset:offset + s.size * count]
+        return list(s.iter_unpack(view))
+
+    def write_struct_array(self, offset, s, records):
+        # type: (int, struct.Struct, List[Tuple]) -> bytes
+        """Packs a sequence of struct records into this segment's data
+        at consecutive offsets. Returns the bytes that were replaced"""
+        s = _as_struct(s)
+        length = s.size * len(records)
+        self._check_offset_len(offset, length)
+        self._check_writeable()
+        orig_data = bytes(self.data[offset:offset + length])
+        pack_into = s.pack_into
+        data = self.data
+        for i, record in enumerate(records):
+            pack_into(data, offset + i * s.size, *record)
+        return orig_data
 
     def insert_struct(self, offset, s, *values):
         # type: (int, struct.Struct, *object) -> int
-        """Packs a struct into this segment's data at an offset. Returns 
+        """Packs a struct into this segment's data at an offset. The
+        struct may be given compiled or as a format string. Returns
         offset + len(data)"""
-        return self.insert(offset, s.pack(*values))
+        return self.insert(offset, _as_struct(s).pack(*values))
 
     def __contains__(self, addr):
-        """Check if address is in this segment"""
-        return self.base <= addr <= self.end
-
-    def _check_offset(self, offset):
-        # type: (int) -> None
-        if not (0 <= offset < len(self.data)):
-            raise IndexError()
+        """Check if address is in this segment. The end address is
+        excluded so that adjacent segments do not overlap."""
+        return self.base <= addr < self.end
 
     def _check_offset_len(self, offset, length):
         # type: (int, int) -> None
-        self._check_offset(offset)
-        if not offset + length <= len(self.data):
+        # One chained comparison covers negative offset, negative
+        # length and overrun in a single pass
+        if not (0 <= offset <= offset + length <= len(self._data)):
             raise IndexError()
 
-    def _update_data(self, new_data):
-        # type: (bytes) -> None
+    def _check_writeable(self):
+        # type: () -> None
         if not self.writeable:
             raise WriteException
-        self.data = new_data
+
+    def _check_resizeable(self):
+        # type: () -> None
+        self._check_writeable()
+        if isinstance(self._data, memoryview):
+            raise WriteException('mapped segments cannot be resized')
@@ -0,0 +1,61 @@
+import os
+import struct
+import tempfile
+from unittest import TestCase, skipIf
+
+from binary_patcher import BinaryPatcher
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TestBinaryPatcher(TestCase):
+    def setUp(self):
+        fd, self.fname = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as fobj:
+            fobj.write(struct.pack('<8B', *range(8)))
+
+    def tearDown(self):
+        os.remove(self.fname)
+
+    def test_apply_edits(self):
+        data = struct.pack('<8B', *range(8))
+
+        b = BinaryPatcher(self.fname)
+        b.apply_edits([(6, 2, b''),
+                       (4, 0, b'\xAA\xBB'),
+                       (0, 2, b'\xCC')])
+        self.assertEqual(b.data, b'\xCC\x02\x03\xAA\xBB\x04\x05')
+
+        b = BinaryPatcher(self.fname)
+        self.assertRaises(IndexError,
+                          lambda: b.apply_edits([(6, 4, b'')]))
+        self.assertRaises(IndexError,
+                          lambda: b.apply_edits([(0, 4, b''),
+                                                 (2, 2, b'XX')]))
+        self.assertEqual(b.data, data)
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_read_array(self):
+        b = BinaryPatcher(self.fname)
+        v = b.read_array('<u2', 4)
+        self.assertEqual(v.tolist(), [0x0100, 0x0302, 0x0504, 0x0706])
+        self.assertEqual(b.cursor, 8)
+        self.assertEqual(b.read_array('<u2', 2, offs=4).tolist(),
+                         [0x0504, 0x0706])
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_write_array(self):
+        b = BinaryPatcher(self.fname)
+        b.write_array(numpy.array([0xAAAA, 0xBBBB], dtype='<u2'),
+                      offs=0)
+        self.assertEqual(b.data[0:4], b'\xAA\xAA\xBB\xBB')
+        self.assertEqual(b.cursor, 4)
+
+    @skipIf(numpy is not None, 'numpy is installed')
+    def test_array_access_without_numpy(self):
+        b = BinaryPatcher(self.fname)
+        self.assertRaises(ImportError, lambda: b.read_array('<u2', 4))
+        self.assertRaises(ImportError, lambda: b.write_array([1, 2]))
@@ -2,7 +2,8 @@ import struct
 from io import BytesIO
 from unittest import TestCase
 
-from memory_patcher import MemoryPatcher, Segment, InvalidAddressException
+from memory_patcher import (MemoryPatcher, Segment,
+                            InvalidAddressException, WriteException)
 
 
 class TestMemoryPatcher(TestCase):
@@ -21,6 +22,18 @@ class TestMemoryPatcher(TestCase):
         self.assertEqual(m.get_segment(0x9), None)
         self.assertEqual(m.get_segment(0x19), None)
 
+        # Mutating the returned list must not bypass the lookup index
+        m.segments.append(Segment(0x20, 0x8))
+        self.assertEqual(len(m.segments), 2)
+        self.assertEqual(m.get_segment(0x20), None)
+
+        # A rejected assignment must leave the patcher untouched
+        def assign_overlapping():
+            m.segments = [lower, upper, Segment(0x4, 0x8)]
+        self.assertRaises(ValueError, assign_overlapping)
+        self.assertEqual(len(m.segments), 2)
+        self.assertEqual(m.get_segment(0x0), lower)
+
     def test_get_segment_by_name(self):
         m = MemoryPatcher()
         lower = Segment(0x0, 0x8, name='Lower')
@@ -56,6 +69,8 @@ class TestMemoryPatcher(TestCase):
         self.assertTrue(lower in m.segments)
         upper = m.add_segment(0x10, 0x8)
         self.assertTrue(upper in m.segments)
+        self.assertRaises(ValueError, lambda: m.add_segment(0x4, 0x8))
+        self.assertRaises(ValueError, lambda: m.add_segment(0xC, 0x8))
 
     @staticmethod
     def _setup_data_test():
@@ -69,6 +84,20 @@ class TestMemoryPatcher(TestCase):
         m.segments += [lower, upper]
         return lower, lower_data, upper, upper_data, m
 
+    def test_map_arena(self):
+        m = MemoryPatcher()
+        m.add_segment(0x0, 0x4)
+        m.add_segment(0x4, 0x4)
+        arena = bytearray(struct.pack('<8B', *range(8)))
+        m.map_arena(arena)
+
+        self.assertEqual(m.read(0x0, 4), arena[0:4])
+        self.assertEqual(m.read(0x4, 4), arena[4:8])
+
+        m.write(0x2, b'\xAA\xBB')
+        m.write(0x4, b'\xCC\xDD')
+        self.assertEqual(arena[2:6], b'\xAA\xBB\xCC\xDD')
+
     def test_read(self):
         (lower_seg, lower_data,
          upper_seg, upper_data, m) = self._setup_data_test()
@@ -110,6 +139,48 @@ class TestMemoryPatcher(TestCase):
         self.assertRaises(InvalidAddressException,
                           lambda: m.write(0x30, write_data_0))
 
+    def test_write_many(self):
+        (lower_seg, lower_data,
+         upper_seg, upper_data, m) = self._setup_data_test()
+
+        write_data_0 = struct.pack('<4B', *range(4))[::-1]
+        write_data_1 = struct.pack('<4B', *range(4, 8))[::-1]
+
+        orig = m.write_many([(0x0, write_data_0),
+                             (0x20, write_data_1),
+                             (0x24, write_data_0)])
+        self.assertEqual(orig, [lower_data[0:4],
+                                upper_data[0:4],
+                                upper_data[4:8]])
+        self.assertEqual(lower_seg.read(0x0, 4), write_data_0)
+        self.assertEqual(upper_seg.read(0x0, 4), write_data_1)
+        self.assertEqual(upper_seg.read(0x4, 4), write_data_0)
+
+        self.assertRaises(
+            InvalidAddressException,
+            lambda: m.write_many([(0x0, write_data_1),
+                                  (0x30, write_data_0)]))
+        self.assertEqual(lower_seg.read(0x0, 4), write_data_0)
+
+        # A write that would overrun its segment must fail the whole
+        # batch before anything is written
+        self.assertRaises(
+            IndexError,
+            lambda: m.write_many([(0x0, write_data_1),
+                                  (0x26, write_data_0)]))
+        self.assertEqual(lower_seg.read(0x0, 4), write_data_0)
+
+        # Likewise a write to a read-only segment
+        ro_seg = Segment(0x40, 0x8, writeable=False)
+        ro_seg.load_stream(BytesIO(lower_data))
+        m.segments += [ro_seg]
+        self.assertRaises(
+            WriteException,
+            lambda: m.write_many([(0x0, write_data_1),
+                                  (0x40, write_data_0)]))
+        self.assertEqual(lower_seg.read(0x0, 4), write_data_0)
+        self.assertEqual(ro_seg.read(0x0, 4), lower_data[0:4])
+
     def test_insert(self):
         (lower_seg, lower_data,
          upper_seg, upper_data, m) = self._setup_data_test()
@@ -1,8 +1,14 @@
 import struct
 from io import BytesIO
-from unittest import TestCase
+from unittest import TestCase, skipIf
 
-from memory_patcher import Segment, InvalidAddressException, WriteException
+from memory_patcher import (Segment, InvalidAddressException,
+                            WriteException, compile_struct)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class TestSegment(TestCase):
@@ -65,12 +71,19 @@ class TestSegment(TestCase):
         s = Segment(0, 0x10)
         s.data = data
         self.assertEqual(s.read(0, 8), data)
-        self.assertEqual(s.read(0, 1), data[0])
+        self.assertEqual(s.read(0, 1), data[0:1])
         self.assertEqual(s.read(4, 4), data[4:])
         self.assertRaises(IndexError, lambda: s.read(-1, 4))
         self.assertRaises(IndexError, lambda: s.read(6, 4))
         self.assertRaises(IndexError, lambda: s.read(9, 4))
 
+        v = s.read(0, 4, copy=False)
+        self.assertIsInstance(v, memoryview)
+        self.assertEqual(v, data[0:4])
+        self.assertRaises(BufferError, lambda: s.cut(0, 4))
+        v.release()
+        self.assertEqual(s.cut(0, 4), data[0:4])
+
     def test_write(self):
         data = struct.pack('<8B', *range(8))
         write_data = struct.pack('<4B', *range(4)[::-1])
@@ -142,3 +155,141 @@ class TestSegment(TestCase):
         s = Segment(0, 0x10, writeable=False)
         s.data = data
         self.assertRaises(WriteException, lambda: s.cut(0, 4))
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_read_array(self):
+        data = struct.pack('<8B', *range(8))
+        s = Segment(0, 0x10)
+        s.data = data
+        v = s.read_array(0, '<u2', 4)
+        self.assertEqual(v.tolist(), [0x0100, 0x0302, 0x0504, 0x0706])
+        self.assertEqual(s.read_array(4, '<u2', 2).tolist(),
+                         [0x0504, 0x0706])
+        self.assertRaises(IndexError, lambda: s.read_array(6, '<u2', 2))
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_write_array(self):
+        data = struct.pack('<8B', *range(8))
+        s = Segment(0, 0x10)
+        s.data = data
+        orig = s.write_array(0, numpy.array([0xAAAA, 0xBBBB],
+                                            dtype='<u2'))
+        self.assertEqual(orig, data[0:4])
+        self.assertEqual(s.data, b'\xAA\xAA\xBB\xBB' + data[4:])
+
+        s = Segment(0, 0x10, writeable=False)
+        s.data = data
+        self.assertRaises(
+            WriteException,
+            lambda: s.write_array(0, numpy.array([1], dtype='<u2')))
+
+    @skipIf(numpy is not None, 'numpy is installed')
+    def test_array_access_without_numpy(self):
+        s = Segment(0, 0x10)
+        s.data = struct.pack('<8B', *range(8))
+        self.assertRaises(ImportError, lambda: s.read_array(0, '<u2', 4))
+        self.assertRaises(ImportError, lambda: s.write_array(0, [1, 2]))
+
+    def test_apply_edits(self):
+        data = struct.pack('<8B', *range(8))
+
+        s = Segment(0, 0x10)
+        s.data = data
+        s.apply_edits([(6, 2, b''),
+                       (4, 0, b'\xAA\xBB'),
+                       (0, 2, b'\xCC')])
+        self.assertEqual(s.data, b'\xCC\x02\x03\xAA\xBB\x04\x05')
+
+        s = Segment(0, 0x10)
+        s.data = data
+        self.assertRaises(IndexError,
+                          lambda: s.apply_edits([(6, 4, b'')]))
+        self.assertRaises(IndexError,
+                          lambda: s.apply_edits([(0, 4, b''),
+                                                 (2, 2, b'')]))
+        self.assertEqual(s.data, data)
+
+        s = Segment(0, 0x10, writeable=False)
+        s.data = data
+        self.assertRaises(WriteException,
+                          lambda: s.apply_edits([(0, 1, b'')]))
+
+    def test_map_buffer(self):
+        arena = bytearray(struct.pack('<8B', *range(8)))
+
+        s = Segment(0, 0x4)
+        s.map_buffer(arena, 4)
+        self.assertEqual(s.read(0, 4), arena[4:8])
+
+        s.write(0, b'\xAA\xBB')
+        self.assertEqual(arena[4:6], b'\xAA\xBB')
+
+        self.assertRaises(WriteException, lambda: s.insert(0, b'\x00'))
+        self.assertRaises(WriteException, lambda: s.cut(0, 2))
+
+        # Loading a stream into a mapped segment fills the window in
+        # place rather than detaching it from the arena
+        s.load_stream(BytesIO(b'\xF0\xF1\xF2\xF3'))
+        self.assertEqual(arena[4:8], b'\xF0\xF1\xF2\xF3')
+        self.assertRaises(IndexError,
+                          lambda: s.load_stream(BytesIO(bytes(5))))
+        self.assertEqual(arena[4:8], b'\xF0\xF1\xF2\xF3')
+
+        s = Segment(0, 0x10)
+        self.assertRaises(IndexError, lambda: s.map_buffer(arena))
+
+    def test_read_struct(self):
+        data = struct.pack('<8B', *range(8))
+        fmt = struct.Struct('<2H')
+        s = Segment(0, 0x10)
+        s.data = data
+        self.assertEqual(s.read_struct(0, fmt), (0x0100, 0x0302))
+        self.assertEqual(s.read_struct(4, fmt), (0x0504, 0x0706))
+        self.assertEqual(s.read_struct(0, '<2H'), (0x0100, 0x0302))
+        self.assertEqual(s.read_struct(0, compile_struct('<2H')),
+                         (0x0100, 0x0302))
+        self.assertIs(compile_struct('<2H'), compile_struct('<2H'))
+        self.assertRaises(IndexError, lambda: s.read_struct(-1, fmt))
+        self.assertRaises(IndexError, lambda: s.read_struct(6, fmt))
+
+    def test_write_struct(self):
+        data = struct.pack('<8B', *range(8))
+        fmt = struct.Struct('<2H')
+        s = Segment(0, 0x10)
+        s.data = data
+        self.assertEqual(s.write_struct(0, fmt, 0xAAAA, 0xBBBB), data[0:4])
+        self.assertEqual(s.data, b'\xAA\xAA\xBB\xBB' + data[4:])
+        self.assertRaises(IndexError,
+                          lambda: s.write_struct(6, fmt, 0, 0))
+
+        s = Segment(0, 0x10, writeable=False)
+        s.data = data
+        self.assertRaises(WriteException,
+                          lambda: s.write_struct(0, fmt, 0, 0))
+
+    def test_read_struct_array(self):
+        data = struct.pack('<8B', *range(8))
+        fmt = struct.Struct('<2B')
+        s = Segment(0, 0x10)
+        s.data = data
+        self.assertEqual(s.read_struct_array(0, fmt, 4),
+                         [(0, 1), (2, 3), (4, 5), (6, 7)])
+        self.assertEqual(s.read_struct_array(4, fmt, 2), [(4, 5), (6, 7)])
+        self.assertRaises(IndexError,
+                          lambda: s.read_struct_array(6, fmt, 2))
+
+    def test_write_struct_array(self):
+        data = struct.pack('<8B', *range(8))
+        fmt = struct.Struct('<2B')
+        s = Segment(0, 0x10)
+        s.data = data
+        records = [(0xAA, 0xBB), (0xCC, 0xDD)]
+        self.assertEqual(s.write_struct_array(0, fmt, records), data[0:4])
+        self.assertEqual(s.data, b'\xAA\xBB\xCC\xDD' + data[4:])
+        self.assertRaises(IndexError,
+                          lambda: s.write_struct_array(6, fmt, records))
+
+        s = Segment(0, 0x10, writeable=False)
+        s.data = data
+        self.assertRaises(WriteException,
+                          lambda: s.write_struct_array(0, fmt, records))